@@ -1,9 +1,73 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
 import json
-from simple_image import Image
-from math import floor, ceil
+import queue
+import argparse
+import threading
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor
+from simple_image import Image, ENCODER_PROFILES
+from partial_jpeg import save_partial_jpeg
+from math import floor, ceil, sqrt
+
+# extensions des fichiers lus comme trames d'une séquence
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+# nombre minimal de trames consécutives confiées à un même processus, pour
+# que les masques et les couleurs moyennes puissent être réutilisés
+MIN_CHUNK_FRAMES = 8
+# nombre approximatif de pixels échantillonnés par `average_color_lattice`
+LATTICE_SAMPLES = 1024
+# nombre minimal de pixels du premier réseau de `average_color_sampled`,
+# graine du tirage de son décalage et quantile de la loi normale pour un
+# intervalle de confiance à 95 %
+SAMPLING_MIN = 64
+SAMPLING_SEED = 0
+SAMPLING_Z = 1.96
+
+def check_shape(shape):
+    """Vérifie la présence des clés attendues pour le type de la forme
+    `shape` (et uniquement elles) et le type des valeurs associées."""
+    if shape["type"] == "circle":
+        # les clés fournies ont-elles les noms attendus ?
+        for key in shape.keys():
+            if key not in ["type", "x", "y", "r"]:
+                print(f"** Clé '{key}' inconnue pour une forme 'circle'")
+                sys.exit(1)
+        # les clés attendues sont-elles présentes avec des valeurs
+        # du bon type (des entiers ou des réels) ?
+        for key in ["x", "y", "r"]:
+            if (key not in shape.keys() or not isinstance(shape[key], (int, float))):
+                print(f"La clé '{key}' d'un 'circle' doit être un nombre")
+                sys.exit(1)
+    elif shape["type"] == "rectangle":
+        # Les clés fournies ont-elles les noms attendus pour un rectangle ?
+        for key in shape.keys():
+            if key not in ["type", "c1x", "c1y", "c2x", "c2y"]:
+                print(f"** Clé '{key}' inconnue pour une forme 'rectangle'")
+                sys.exit(1)
+        # Les clés attendues sont-elles présentes avec des valeurs
+        # du bon type (des entiers ou des réels) ?
+        for key in ["c1x", "c1y", "c2x", "c2y"]:
+            if (key not in shape.keys() or not isinstance(shape[key], (int, float))):
+                print(f"La clé '{key}' d'un 'rectangle' doit être un nombre")
+                sys.exit(1)
+    elif shape["type"] == "ellipse":
+        # Les clés fournies ont-elles les noms attendus pour une ellipse ?
+        for key in shape.keys():
+            if key not in ["type", "x", "y", "a", "b"]:
+                print(f"** Clé '{key}' inconnue pour une forme 'ellipse'")
+                sys.exit(1)
+        # Les clés attendues sont-elles présentes avec des valeurs
+        # du bon type (des entiers ou des réels) ?
+        for key in ["x", "y", "a", "b"]:
+            if (key not in shape.keys() or not isinstance(shape[key], (int, float))):
+                print(f"La clé '{key}' d'une 'ellipse' doit être un nombre")
+                sys.exit(1)
+    else:
+        print(f"** Forme '{shape['type']}' inconnue !")
 
 def read_orders_from_json(json_filename):
     """Lit et retourne les ordres depuis le fichier JSON nommé
@@ -12,11 +76,22 @@ def read_orders_from_json(json_filename):
     with open(json_filename, 'r') as f:
         orders = json.load(f)
     # on vérifie la présence des 3 clés de base (et uniquement elles) et
-    # le type de valeurs associées
+    # le type de valeurs associées ; pour une séquence de trames, la clé
+    # 'frames' (répertoire des trames à lire) remplace la clé 'in' et
+    # 'out' est le répertoire des trames à produire. La clé facultative
+    # 'profile' choisit les réglages de l'encodeur de l'image produite
     for key in orders.keys():
-        if key not in ["out", "in", "shapes"]:
+        if key not in ["out", "in", "shapes", "frames", "profile"]:
             print(f"** Clé '{key}' inconnue")
-    if "in" not in orders.keys() or not isinstance(orders["in"], str):
+    if "profile" in orders.keys() and (not isinstance(orders["profile"], str)
+                                       or orders["profile"] not in ENCODER_PROFILES):
+        print("** La clé 'profile' doit valoir", " ou ".join(f"'{name}'" for name in ENCODER_PROFILES))
+        sys.exit(1)
+    if "frames" in orders.keys():
+        if not isinstance(orders["frames"], str):
+            print("** La clé 'frames' doit être le nom du répertoire des trames à lire")
+            sys.exit(1)
+    elif "in" not in orders.keys() or not isinstance(orders["in"], str):
         print("** La clé 'in' doit être le nom du fichier image à lire")
         sys.exit(1)
     if "out" not in orders.keys() or not isinstance(orders["out"], str):
@@ -31,50 +106,38 @@ def read_orders_from_json(json_filename):
         if "type" not in shape.keys():
             print("** Une forme doit définir la clé 'type'")
             sys.exit(1)
-        if shape["type"] == "circle":
-            # les clés fournies ont-elles les noms attendus ?
-            for key in shape.keys():
-                if key not in ["type", "x", "y", "r"]:
-                    print(f"** Clé '{key}' inconnue pour une forme 'circle'")
-                    sys.exit(1)
-            # les clés attendues sont-elles présentes avec des valeurs
-            # du bon type (des entiers ou des réels) ?
-            for key in ["x", "y", "r"]:
-                if (key not in shape.keys() or not isinstance(shape[key], (int, float))):
-                    print(f"La clé '{key}' d'un 'circle' doit être un nombre")
-                    sys.exit(1)
-        elif shape["type"] == "rectangle":
-            # Les clés fournies ont-elles les noms attendus pour un rectangle ?
-            for key in shape.keys():
-                if key not in ["type", "c1x", "c1y", "c2x", "c2y"]:
-                    print(f"** Clé '{key}' inconnue pour une forme 'rectangle'")
-                    sys.exit(1)
-            # Les clés attendues sont-elles présentes avec des valeurs
-            # du bon type (des entiers ou des réels) ?
-            for key in ["c1x", "c1y", "c2x", "c2y"]:
-                if (key not in shape.keys() or not isinstance(shape[key], (int, float))):
-                    print(f"La clé '{key}' d'un 'rectangle' doit être un nombre")
-                    sys.exit(1)
-        elif shape["type"] == "ellipse":
-            # Les clés fournies ont-elles les noms attendus pour une ellipse ?
+        if "keyframes" in shape.keys():
+            # forme animée : chaque image clé donne le numéro de sa trame
+            # (clé 'frame', le dernier nombre du nom de fichier de la
+            # trame) et les clés de la forme à cette trame
+            if "frames" not in orders.keys():
+                print("** La clé 'keyframes' n'est permise que pour une séquence de trames"
+                      " (clé 'frames')")
+                sys.exit(1)
+            keyframes = shape["keyframes"]
+            if (not isinstance(keyframes, list) or len(keyframes) == 0
+                or any(not isinstance(keyframe, dict)
+                       or not isinstance(keyframe.get("frame"), int)
+                       for keyframe in keyframes)):
+                print("** La clé 'keyframes' doit être une liste non vide"
+                      " d'images clés définissant la clé 'frame' (numéro de trame"
+                      " lu dans le nom de son fichier)")
+                sys.exit(1)
             for key in shape.keys():
-                if key not in ["type", "x", "y", "a", "b"]:
-                    print(f"** Clé '{key}' inconnue pour une forme 'ellipse'")
-                    sys.exit(1)
-            # Les clés attendues sont-elles présentes avec des valeurs
-            # du bon type (des entiers ou des réels) ?
-            for key in ["x", "y", "a", "b"]:
-                if (key not in shape.keys() or not isinstance(shape[key], (int, float))):
-                    print(f"La clé '{key}' d'une 'ellipse' doit être un nombre")
+                if key not in ["type", "keyframes"]:
+                    print(f"** Clé '{key}' inconnue pour une forme animée")
                     sys.exit(1)
+            for keyframe in keyframes:
+                check_shape(shape_at_frame(shape, keyframe["frame"]))
         else:
-            print(f"** Forme '{shape['type']}' inconnue !")
+            check_shape(shape)
 
-    # on retrouve le chemin d'accès des images `in` et `out`
-    # relativement au chemin d'accès du fichier JSON
+    # on retrouve le chemin d'accès des images `in` (ou du répertoire
+    # `frames`) et `out` relativement au chemin d'accès du fichier JSON
     dirname = os.path.dirname(json_filename)
-    orders["in"] = os.path.join(dirname, orders["in"])
-    orders["out"] = os.path.join(dirname, orders["out"])
+    for key in ["in", "frames", "out"]:
+        if key in orders.keys():
+            orders[key] = os.path.join(dirname, orders[key])
     return orders
 
 def clone_image(im):
@@ -203,43 +266,515 @@ def fill_ellipse(im, cxy, a, b, color):
                 if ((x - centerX) ** 2 / (a ** 2)) + ((y - centerY) ** 2 / (b ** 2)) <= 1:
                     im.set_color((x, y), color)
 
-def exec_orders(orders):
-    """Exécute les ordres spécifiés dans le fichier d'ordres."""
-    im_in = Image.read(orders["in"])
-    im_out = clone_image(im_in)
+def average_color_shape(im, shape):
+    """Calculer la couleur moyenne de la forme `shape` dans l'image.
+    Retourne None pour une forme inconnue."""
+    if shape["type"] == "circle":
+        return average_color_circle(im, (shape["x"], shape["y"]), shape["r"])
+    elif shape["type"] == "rectangle":
+        return average_color_rectangle(im, (shape["c1x"], shape["c1y"]),
+                                       (shape["c2x"], shape["c2y"]))
+    elif shape["type"] == "ellipse":
+        return average_color_ellipse(im, (shape["x"], shape["y"]),
+                                     shape["a"], shape["b"])
+    return None
 
+def fill_shape(im, shape, color):
+    """Remplir la forme `shape` dans l'image avec la couleur spécifiée."""
+    if shape["type"] == "circle":
+        fill_circle(im, (shape["x"], shape["y"]), shape["r"], color)
+    elif shape["type"] == "rectangle":
+        fill_rectangle(im, (shape["c1x"], shape["c1y"]),
+                       (shape["c2x"], shape["c2y"]), color)
+    elif shape["type"] == "ellipse":
+        fill_ellipse(im, (shape["x"], shape["y"]), shape["a"], shape["b"], color)
 
-    for shape in orders["shapes"]:
-        if shape["type"] == "circle":
-            cxy = (shape["x"], shape["y"])
-            cr = shape["r"]
-            color = average_color_circle(im_in, cxy, cr)
-            fill_circle(im_out, cxy, cr, color)
-        elif shape["type"] == "rectangle":
-            c1xy = (shape["c1x"], shape["c1y"])
-            c2xy = (shape["c2x"], shape["c2y"])
-            color = average_color_rectangle(im_in, c1xy, c2xy)
-            fill_rectangle(im_out, c1xy, c2xy, color)
-        elif shape["type"] == "ellipse":
-            cxy = (shape["x"], shape["y"])
-            a = shape["a"]
-            b = shape["b"]
-            color = average_color_ellipse(im_in, cxy, a, b)
-            fill_ellipse(im_out, cxy, a, b, color)
-
-    im_out.save(orders["out"])
+def shape_bbox(im, shape):
+    """Retourne la boîte (x0, y0, x1, y1), bornes x1 et y1 exclues, des
+    pixels de l'image que `fill_shape` peut modifier, ou None si la forme
+    est inconnue ou en dehors de l'image."""
+    if shape["type"] == "circle":
+        x0, x1 = floor(shape["x"] - shape["r"]), ceil(shape["x"] + shape["r"])
+        y0, y1 = floor(shape["y"] - shape["r"]), ceil(shape["y"] + shape["r"])
+    elif shape["type"] == "rectangle":
+        x0, x1 = floor(shape["c1x"]), ceil(shape["c2x"])
+        y0, y1 = floor(shape["c1y"]), ceil(shape["c2y"])
+    elif shape["type"] == "ellipse":
+        x0, x1 = floor(shape["x"] - shape["a"]), ceil(shape["x"] + shape["a"])
+        y0, y1 = floor(shape["y"] - shape["b"]), ceil(shape["y"] + shape["b"])
+    else:
+        return None
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, im.width), min(y1, im.height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+def is_jpeg_filename(filename):
+    """Le fichier `filename` est-il une image JPEG (d'après son
+    extension) ?"""
+    return os.path.splitext(filename)[1].lower() in (".jpg", ".jpeg")
+
+def average_color_lattice(im, shape):
+    """Calculer une estimation de la couleur moyenne de la forme `shape`
+    sur un réseau régulier d'environ `LATTICE_SAMPLES` de ses pixels.
+    Retourne None pour une forme inconnue."""
+    box = shape_bbox(im, shape)
+    if box is None:
+        return average_color_shape(im, shape)
+    x0, y0, x1, y1 = box
+    step = max(1, floor(sqrt((x1 - x0) * (y1 - y0) / LATTICE_SAMPLES)))
+    mask = shape_mask(im, shape, step)
+    if len(mask) == 0:
+        # forme trop fine pour être échantillonnée par le réseau
+        return average_color_shape(im, shape)
+    return average_color_mask(im, mask)
+
+def average_color_sampled(im, shape, max_error):
+    """Estimer la couleur moyenne de la forme `shape` sur un réseau de
+    pixels décalé au hasard (chaque pixel représente la strate de `step`
+    x `step` pixels qui l'entoure), raffiné de moitié en moitié jusqu'à
+    ce que l'erreur sur la moyenne de chaque composante (demi-largeur de
+    l'intervalle de confiance à 95 %) soit au plus `max_error`. Au pas 1
+    tous les pixels sont parcourus et le résultat est exact. Retourne la
+    couleur (None pour une forme inconnue), l'erreur atteinte par
+    composante et le nombre de pixels échantillonnés."""
+    box = shape_bbox(im, shape)
+    if box is None:
+        return average_color_shape(im, shape), (0.0, 0.0, 0.0), 0
+    x0, y0, x1, y1 = box
+    # pas initial : une puissance de 2 donnant au moins SAMPLING_MIN pixels
+    step = 1
+    while (x1 - x0) * (y1 - y0) >= 4 * SAMPLING_MIN * step * step:
+        step *= 2
+    # décalage du réseau, tiré une fois pour toutes : les réseaux de pas
+    # step / 2, step / 4... contiennent tous les points des précédents
+    rng = random.Random(SAMPLING_SEED)
+    ox, oy = rng.randrange(step), rng.randrange(step)
+    total_color = [0, 0, 0]
+    total_square = [0, 0, 0]
+    seen = set()
+    while True:
+        mask = shape_mask(im, shape, step, (ox % step, oy % step))
+        for xy in mask:
+            if xy not in seen:
+                color = im.get_color(xy)
+                for c in range(3):
+                    total_color[c] += color[c]
+                    total_square[c] += color[c] ** 2
+        seen = set(mask)
+        n = len(mask)
+        if step == 1:
+            error = (0.0, 0.0, 0.0)
+            break
+        if n >= 2:
+            # correction de population finie : la forme couvre environ
+            # n * step * step pixels
+            fpc = max(0.0, 1 - 1 / (step * step))
+            error = tuple(
+                SAMPLING_Z * sqrt(max(0.0, total_square[c] - total_color[c] ** 2 / n)
+                                  / (n - 1) / n * fpc)
+                for c in range(3))
+            if max(error) <= max_error:
+                break
+        step //= 2
+    if n == 0:
+        # Return black if no valid pixels found
+        return (0, 0, 0), error, 0
+    color = tuple(total_color[c] // n for c in range(3))
+    return color, error, n
+
+def process_orders(orders, im_in, deadline=None, max_error=None):
+    """Floute les formes des ordres `orders` dans l'image `im_in`. Si
+    `max_error` est donné, la couleur moyenne de chaque forme est estimée
+    par `average_color_sampled` avec cette erreur maximale. Passé
+    l'instant `deadline` (en secondes, selon `time.monotonic`), les formes
+    restantes sont floutées de façon approchée mais restent entièrement
+    recouvertes : leur couleur moyenne est estimée avec
+    `average_color_lattice` et c'est leur boîte englobante qui est
+    remplie. Retourne l'image produite, les boîtes des zones modifiées et
+    les indices des formes approchées faute de temps."""
+    def late():
+        return deadline is not None and time.monotonic() > deadline
+
+    degraded = set()
+    def average(i, shape):
+        if i in degraded or late():
+            degraded.add(i)
+            return average_color_lattice(im_in, shape)
+        if max_error is not None:
+            color, error, n = average_color_sampled(im_in, shape, max_error)
+            if color is not None:
+                print(f"  Forme {i} : couleur moyenne estimée sur {n} pixels,"
+                      " erreur ± " + ", ".join(f"{e:.2f}" for e in error))
+            return color
+        return average_color_shape(im_in, shape)
+
+    if is_jpeg_filename(orders["in"]) and is_jpeg_filename(orders["out"]):
+        # JPEG vers JPEG : seuls les blocs DCT modifiés pourront être
+        # ré-encodés (voir `save_orders_image`). Toutes les couleurs
+        # moyennes sont calculées avant de modifier `im_in`, il est donc
+        # inutile de cloner l'image
+        im_out = im_in
+        colors = [average(i, shape) for i, shape in enumerate(orders["shapes"])]
+    else:
+        # avec un délai, le clonage pixel par pixel consommerait à lui seul
+        # une bonne partie du budget
+        im_out = clone_image(im_in) if deadline is None else im_in.copy()
+        colors = None
+    boxes = []
+    for i, shape in enumerate(orders["shapes"]):
+        color = average(i, shape) if colors is None else colors[i]
+        if color is None:
+            continue
+        box = shape_bbox(im_out, shape)
+        if i in degraded or late():
+            degraded.add(i)
+            if box is not None:
+                im_out.fill_box(box, color)
+        else:
+            fill_shape(im_out, shape, color)
+        if box is not None:
+            boxes.append(box)
+    if len(degraded) > 0:
+        print(f"** Délai dépassé pour '{orders['in']}', formes approchées :",
+              ", ".join(str(i) for i in sorted(degraded)))
+    return im_out, boxes, sorted(degraded)
+
+def save_orders_image(orders, im_out, boxes, partial=False, deadline=None):
+    """Enregistre l'image produite par les ordres `orders` avec le profil
+    d'encodeur de leur clé 'profile'. Si `partial` est vrai, d'une image
+    JPEG vers une image JPEG, seuls les blocs DCT recouverts par les
+    boîtes `boxes` sont ré-encodés (avec les tables de quantification
+    d'origine), les autres sont recopiés sans perte depuis le fichier
+    d'entrée ; un profil d'encodeur l'emporte sur l'écriture partielle.
+    Passé l'instant `deadline` (voir `process_orders`), l'image est
+    enregistrée sans écriture partielle avec le profil 'fastest'."""
+    partial = partial and is_jpeg_filename(orders["in"]) and is_jpeg_filename(orders["out"])
+    if partial and "profile" in orders.keys():
+        print(f"** Profil '{orders['profile']}' demandé pour '{orders['out']}',"
+              " écriture partielle ignorée")
+        partial = False
+    if deadline is not None and time.monotonic() > deadline:
+        print(f"** Délai dépassé pour '{orders['out']}', enregistrement avec le profil 'fastest'")
+        im_out.save(orders["out"], "fastest")
+    elif not (partial and save_partial_jpeg(im_out, orders["in"], boxes, orders["out"])):
+        im_out.save(orders["out"], orders.get("profile"))
     print(f"Image enregistrée sous '{orders['out']}'.")
 
+def exec_orders(orders, budget=None, max_error=None, partial=False):
+    """Exécute les ordres spécifiés dans le fichier d'ordres, avec un
+    budget de `budget` secondes pour la lecture, le floutage et
+    l'écriture (voir `process_orders` et `save_orders_image`) et avec
+    l'erreur maximale `max_error` sur les couleurs moyennes, en écrivant
+    partiellement les images JPEG si `partial` est vrai. Retourne les
+    indices des formes approchées faute de temps."""
+    deadline = None if budget is None else time.monotonic() + budget
+    im_in = Image.read(orders["in"])
+    im_out, boxes, degraded = process_orders(orders, im_in, deadline, max_error)
+    save_orders_image(orders, im_out, boxes, partial, deadline)
+    return degraded
+
+def shape_at_frame(shape, index):
+    """Retourne la forme `shape` à la trame numéro `index` (le numéro lu
+    dans le nom de fichier de la trame, voir `list_frames`). Les clés
+    d'une forme animée sont interpolées linéairement entre les deux
+    images clés qui encadrent la trame (et figées avant la première et
+    après la dernière image clé)."""
+    if "keyframes" not in shape.keys():
+        return shape
+    keyframes = sorted(shape["keyframes"], key=lambda keyframe: keyframe["frame"])
+    before = after = keyframes[0]
+    for keyframe in keyframes:
+        after = keyframe
+        if keyframe["frame"] >= index:
+            break
+        before = keyframe
+    if after["frame"] <= index or before["frame"] >= index:
+        before = after
+    res = {"type": shape["type"]}
+    for key, value in before.items():
+        if key == "frame":
+            continue
+        if before is after:
+            res[key] = value
+        else:
+            t = (index - before["frame"]) / (after["frame"] - before["frame"])
+            res[key] = value + (after[key] - value) * t
+    return res
+
+def shape_mask(im, shape, step=1, offset=None):
+    """Retourne la liste des pixels de l'image couverts par la forme
+    `shape` (ceux que parcourent `average_color_shape` et `fill_shape`).
+    Avec `step` > 1, on ne garde qu'un pixel sur `step` en x et en y, à
+    partir du décalage `offset` (par défaut au milieu du premier pas) par
+    rapport au coin de la boîte englobante de la forme."""
+    box = shape_bbox(im, shape)
+    if box is None:
+        return []
+    x0, y0, x1, y1 = box
+    ox, oy = (step // 2, step // 2) if offset is None else offset
+    xs = range(x0 + ox, x1, step)
+    ys = range(y0 + oy, y1, step)
+    if shape["type"] == "circle":
+        centerX, centerY, cr = shape["x"], shape["y"], shape["r"]
+        return [(x, y) for x in xs for y in ys
+                if (x - centerX) ** 2 + (y - centerY) ** 2 <= cr ** 2]
+    elif shape["type"] == "ellipse":
+        centerX, centerY, a, b = shape["x"], shape["y"], shape["a"], shape["b"]
+        return [(x, y) for x in xs for y in ys
+                if ((x - centerX) ** 2 / (a ** 2)) + ((y - centerY) ** 2 / (b ** 2)) <= 1]
+    return [(x, y) for x in xs for y in ys]
+
+def average_color_mask(im, mask):
+    """Calculer la couleur moyenne des pixels `mask` de l'image."""
+    if len(mask) == 0:
+        # Return black if no valid pixels found
+        return (0, 0, 0)
+    total_color = [0, 0, 0]
+    for xy in mask:
+        color = im.get_color(xy)
+        total_color[0] += color[0]
+        total_color[1] += color[1]
+        total_color[2] += color[2]
+    return (
+        total_color[0] // len(mask),
+        total_color[1] // len(mask),
+        total_color[2] // len(mask),
+    )
+
+def fill_mask(im, mask, color):
+    """Remplir les pixels `mask` de l'image avec la couleur spécifiée."""
+    for xy in mask:
+        im.set_color(xy, color)
+
+def frame_number(name):
+    """Retourne le numéro de la trame `name` : le dernier nombre de son
+    nom de fichier (None s'il n'en contient pas)."""
+    numbers = re.findall(r"\d+", os.path.splitext(name)[0])
+    return int(numbers[-1]) if numbers else None
+
+def list_frames(dirname):
+    """Retourne les couples (numéro, nom de fichier) des fichiers images
+    du répertoire `dirname`, triés selon leur numéro (voir
+    `frame_number`)."""
+    names = [name for name in os.listdir(dirname)
+             if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+    return sorted(((frame_number(name), name) for name in names),
+                  key=lambda frame: (frame[0] is None, frame[0] or 0, frame[1]))
+
+def exec_frames(orders, frames, partial=False):
+    """Floute dans l'ordre les trames `frames` (couples (numéro, nom de
+    fichier)) d'une séquence, en écrivant partiellement les trames JPEG
+    si `partial` est vrai. D'une trame à la suivante, le masque d'une
+    forme dont la géométrie n'a pas changé est réutilisé, ainsi que sa
+    couleur moyenne si les pixels qu'elle recouvre n'ont pas changé.
+    Retourne le nombre de couleurs moyennes réutilisées."""
+    previous = None
+    # pour chaque forme : (forme, masque, boîte, couleur) à la trame précédente
+    last = {}
+    reused = 0
+    for index, name in frames:
+        filepath = os.path.join(orders["frames"], name)
+        im_in = Image.read(filepath)
+        im_out = im_in.copy()
+        boxes = []
+        for i, shape in enumerate(orders["shapes"]):
+            shape = shape_at_frame(shape, index)
+            if (i in last and last[i][0] == shape
+                and previous.definition == im_in.definition):
+                _, mask, box, color = last[i]
+                if box is None or im_in.same_region(previous, box):
+                    reused += 1
+                else:
+                    color = average_color_mask(im_in, mask)
+            else:
+                mask = shape_mask(im_in, shape)
+                box = shape_bbox(im_in, shape)
+                color = average_color_mask(im_in, mask)
+            last[i] = (shape, mask, box, color)
+            fill_mask(im_out, mask, color)
+            if box is not None:
+                boxes.append(box)
+        previous = im_in
+
+        out = os.path.join(orders["out"], name)
+        if not (partial and is_jpeg_filename(name)
+                and save_partial_jpeg(im_out, filepath, boxes, out)):
+            im_out.save(out, orders.get("profile"))
+    return reused
+
+def exec_sequence(orders, partial=False):
+    """Exécute les ordres d'une séquence de trames : les trames sont
+    réparties par paquets consécutifs (d'au moins MIN_CHUNK_FRAMES
+    trames) entre plusieurs processus, qui
+    lisent, floutent et écrivent leurs trames en parallèle (partiellement
+    pour les trames JPEG si `partial` est vrai)."""
+    frames = list_frames(orders["frames"])
+    if len(frames) == 0:
+        print(f"Pas de trames dans le répertoire '{orders['frames']}'")
+        return
+    if frames[-1][0] is None:
+        print(f"** Le nom de la trame '{frames[-1][1]}' ne contient pas de numéro")
+        return
+    if partial and "profile" in orders.keys():
+        print(f"** Profil '{orders['profile']}' demandé pour '{orders['out']}',"
+              " écriture partielle ignorée")
+        partial = False
+    os.makedirs(orders["out"], exist_ok=True)
+    size = max(MIN_CHUNK_FRAMES, ceil(len(frames) / (os.cpu_count() or 1)))
+    chunks = [frames[i:i + size] for i in range(0, len(frames), size)]
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        reused = sum(executor.map(exec_frames, [orders] * len(chunks), chunks,
+                                  [partial] * len(chunks)))
+    print(f"{len(frames)} trames enregistrées dans '{orders['out']}'"
+          f" ({reused} couleurs moyennes réutilisées).")
+
+def exec_orders_pipeline(orders_list, decoders=2, encoders=2, depth=4, budget=None,
+                         max_error=None, partial=False):
+    """Exécute plusieurs ordres en recouvrant leurs étapes : un groupe de
+    threads lit les images, le thread principal les floute et un second
+    groupe de threads les écrit (PIL libère le GIL pendant la lecture et
+    l'écriture). Les étapes communiquent par des files bornées à `depth`
+    images, une étape trop rapide attend donc que la suivante avance :
+    pendant que l'image N est écrite, l'image N+1 est floutée et l'image
+    N+2 est lue. Le budget de temps `budget` de chaque image (voir
+    `exec_orders`) court à partir du début de sa lecture, `max_error` est
+    transmis à `process_orders` et `partial` à `save_orders_image`.
+    Retourne pour chaque file ('decode' entre la lecture et le floutage,
+    'encode' entre le floutage et l'écriture) sa profondeur moyenne et
+    maximale, relevée à chaque retrait."""
+    todo = queue.Queue()
+    for orders in orders_list:
+        todo.put(orders)
+    decoded = queue.Queue(maxsize=depth)
+    processed = queue.Queue(maxsize=depth)
+    depths = {"decode": [], "encode": []}
+
+    def decode():
+        while True:
+            try:
+                orders = todo.get_nowait()
+            except queue.Empty:
+                return
+            start = time.monotonic()
+            im_in = None
+            # une erreur ne doit pas arrêter le thread : le thread principal
+            # attend un résultat pour chaque ordre
+            try:
+                im_in = Image.read(orders["in"])
+            except Exception as e:
+                print(f"** Lecture de '{orders['in']}' impossible : {e}")
+            finally:
+                decoded.put((orders, im_in, start))
+
+    def encode():
+        while True:
+            depths["encode"].append(processed.qsize())
+            item = processed.get()
+            if item is None:
+                return
+            try:
+                orders, im_out, boxes, deadline = item
+                save_orders_image(orders, im_out, boxes, partial, deadline)
+            except Exception as e:
+                print(f"** Écriture de '{item[0]['out']}' impossible : {e}")
+
+    threads = ([threading.Thread(target=decode, daemon=True) for _ in range(decoders)]
+               + [threading.Thread(target=encode, daemon=True) for _ in range(encoders)])
+    for thread in threads:
+        thread.start()
+    for _ in range(len(orders_list)):
+        depths["decode"].append(decoded.qsize())
+        orders, im_in, start = decoded.get()
+        if im_in is not None:
+            deadline = None if budget is None else start + budget
+            im_out, boxes, _ = process_orders(orders, im_in, deadline, max_error)
+            processed.put((orders, im_out, boxes, deadline))
+    for _ in range(encoders):
+        processed.put(None)
+    for thread in threads:
+        thread.join()
+    return {stage: {"mean": sum(values) / len(values) if values else 0.0,
+                    "max": max(values, default=0)}
+            for stage, values in depths.items()}
+
+def positive_int(text):
+    """Type des options entières strictement positives."""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"'{text}' n'est pas un entier strictement positif")
+    return value
+
+def positive_float(text):
+    """Type des options réelles strictement positives."""
+    value = float(text)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"'{text}' n'est pas un réel strictement positif")
+    return value
+
 def main():
-    """Programme principale qui lit ou demande un fichier d'ordres puis
-    les exécute."""
-    if len(sys.argv) == 2:
-        orders_filename = sys.argv[1]
-    else:
-        orders_filename = input("Nom du fichier d'ordres: ")
+    """Programme principal qui lit ou demande un ou plusieurs fichiers
+    d'ordres puis les exécute."""
+    parser = argparse.ArgumentParser(
+        description="Floute des zones d'images décrites par des fichiers d'ordres JSON.")
+    parser.add_argument("orders", nargs="*", help="fichiers d'ordres")
+    parser.add_argument("--detect", action="store_true",
+                        help="les arguments sont des images dont on floute les visages détectés")
+    parser.add_argument("--detect-shape", choices=["ellipse", "circle"], default="ellipse",
+                        help="forme qui recouvre chaque visage détecté")
+    parser.add_argument("--decoders", type=positive_int, default=2,
+                        help="nombre de threads de lecture des images (plusieurs fichiers d'ordres)")
+    parser.add_argument("--encoders", type=positive_int, default=2,
+                        help="nombre de threads d'écriture des images (plusieurs fichiers d'ordres)")
+    parser.add_argument("--profile", choices=list(ENCODER_PROFILES), default=None,
+                        help="profil d'encodeur des images produites dont le fichier"
+                             " d'ordres ne précise pas la clé 'profile'")
+    parser.add_argument("--deadline", type=positive_float, default=None,
+                        help="budget de temps en secondes par image, au-delà duquel les"
+                             " formes restantes sont floutées de façon approchée et"
+                             " l'image est écrite avec le profil 'fastest'")
+    parser.add_argument("--max-error", type=positive_float, default=None,
+                        help="estime les couleurs moyennes sur un échantillon de pixels,"
+                             " avec cette erreur maximale par composante (calcul exact par défaut)")
+    parser.add_argument("--partial-jpeg", action="store_true",
+                        help="d'une image JPEG vers une image JPEG, ne ré-encode que les blocs"
+                             " modifiés (JPEG séquentiel de base uniquement)")
+    parser.add_argument("--queue-depth", type=positive_int, default=4,
+                        help="nombre maximal d'images en attente entre deux étapes")
+    args = parser.parse_args()
+    filenames = args.orders or [input("Nom du fichier d'ordres: ")]
 
-    orders = read_orders_from_json(orders_filename)
-    exec_orders(orders)
+    orders_list = []
+    for filename in filenames:
+        if args.detect:
+            # OpenCV n'est nécessaire que pour la détection des visages
+            from detection import detect_faces, orders_from_faces, blurred_filename
+            faces = detect_faces(filename)
+            print(f"{len(faces)} visage(s) détecté(s) dans '{filename}'.")
+            orders = orders_from_faces(faces, filename, blurred_filename(filename),
+                                       args.detect_shape)
+        else:
+            orders = read_orders_from_json(filename)
+        if args.profile is not None and "profile" not in orders.keys():
+            orders["profile"] = args.profile
+        if "frames" in orders.keys():
+            if args.deadline is not None or args.max_error is not None:
+                print("** Les options --deadline et --max-error ne s'appliquent pas"
+                      " à une séquence de trames")
+                sys.exit(1)
+            exec_sequence(orders, args.partial_jpeg)
+        else:
+            orders_list.append(orders)
+    if len(orders_list) == 1:
+        exec_orders(orders_list[0], args.deadline, args.max_error, args.partial_jpeg)
+    elif len(orders_list) > 1:
+        metrics = exec_orders_pipeline(orders_list, args.decoders, args.encoders,
+                                       args.queue_depth, args.deadline, args.max_error,
+                                       args.partial_jpeg)
+        for stage, stats in metrics.items():
+            print(f"File '{stage}' : profondeur moyenne {stats['mean']:.1f},"
+                  f" maximale {stats['max']}")
 
 if __name__ == "__main__":
     main()
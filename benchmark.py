@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Compare les profils d'encodeur (voir `simple_image.ENCODER_PROFILES`) :
+pour chaque image, chaque format et chaque profil, affiche le temps
+d'écriture et la taille du fichier produit."""
+import os
+import sys
+import time
+import tempfile
+from simple_image import Image, ENCODER_PROFILES
+
+# extension utilisée pour chaque format comparé
+FORMATS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+# nombre d'écritures dont on garde le meilleur temps
+REPEAT = 3
+
+def benchmark_image(im, dirname):
+    """Écrit l'image `im` dans `dirname` pour chaque format et chaque
+    profil (None : réglages par défaut de PIL) et retourne la liste des
+    (format, profil, meilleur temps en secondes, taille en octets)."""
+    results = []
+    for image_format, extension in FORMATS.items():
+        filepath = os.path.join(dirname, "benchmark" + extension)
+        for profile in [None] + list(ENCODER_PROFILES):
+            best = None
+            for _ in range(REPEAT):
+                start = time.perf_counter()
+                im.save(filepath, profile)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results.append((image_format, profile, best, os.path.getsize(filepath)))
+    return results
+
+def main():
+    """Programme principal qui compare les profils sur les images passées
+    en arguments (par défaut les images floutées de référence)."""
+    filenames = sys.argv[1:]
+    if len(filenames) == 0:
+        dirname = os.path.join(os.path.dirname(__file__), "images-reference")
+        filenames = sorted(os.path.join(dirname, name) for name in os.listdir(dirname))
+    Image.trace = False
+    with tempfile.TemporaryDirectory() as dirname:
+        for filename in filenames:
+            im = Image.read(filename)
+            print(f"{filename} ({im.width}x{im.height})")
+            for image_format, profile, elapsed, size in benchmark_image(im, dirname):
+                print(f"  {image_format:5} {profile or 'défaut':9}"
+                      f" {elapsed * 1000:8.1f} ms {size / 1024:10.1f} Kio")
+
+if __name__ == "__main__":
+    main()
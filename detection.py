@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Génération automatique des ordres de floutage à partir des visages
+détectés dans une image par une cascade de Haar d'OpenCV.
+
+La détection se fait sur une pyramide d'images réduites de moitié en
+moitié : à chaque niveau on ne cherche que les visages d'une certaine
+plage de tailles, les plus grands étant trouvés aux niveaux suivants.
+Chaque niveau est découpé en tuiles qui se recouvrent, les tuiles sont
+réparties entre plusieurs processus, puis les détections brutes de
+toutes les tuiles sont regroupées comme le ferait `detectMultiScale` sur
+l'image entière."""
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+
+CASCADE = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+
+# côté le plus long de l'image réduite sur laquelle commence la détection
+MAX_SIDE = 1600
+# taille minimale en pixels d'un visage (taille de la fenêtre de la cascade)
+MIN_FACE = 24
+# nombre minimal de détections brutes voisines pour retenir un visage
+MIN_NEIGHBORS = 3
+# taille des tuiles (hors recouvrement) réparties entre les processus
+TILE = 512
+
+# classifieur chargé une seule fois par processus
+classifier = None
+
+def detect_tile(task):
+    """Détecte les visages d'une tuile. `task` contient la tuile (en
+    niveaux de gris), la position de son coin dans son niveau de la
+    pyramide, le facteur d'échelle de ce niveau vers l'image d'origine et
+    les tailles minimale et maximale (None : pas de limite) des visages
+    cherchés. Retourne les détections brutes (x, y, w, h), non
+    regroupées, dans l'image d'origine."""
+    global classifier
+    if classifier is None:
+        # un seul thread OpenCV par processus : le parallélisme vient des tuiles
+        cv2.setNumThreads(1)
+        classifier = cv2.CascadeClassifier(CASCADE)
+    tile, (ox, oy), scale, min_size, max_size = task
+    sizes = {"minSize": (min_size, min_size)}
+    if max_size is not None:
+        sizes["maxSize"] = (max_size, max_size)
+    faces = classifier.detectMultiScale(tile, scaleFactor=1.1, minNeighbors=0, **sizes)
+    return [(round((x + ox) * scale), round((y + oy) * scale),
+             round(w * scale), round(h * scale)) for (x, y, w, h) in faces]
+
+def pyramid_tasks(gray):
+    """Découpe chaque niveau de la pyramide de l'image `gray` en tuiles
+    et retourne la liste des tâches pour `detect_tile`."""
+    height, width = gray.shape
+    scale = max(1.0, max(width, height) / MAX_SIDE)
+    level = gray
+    if scale > 1:
+        level = cv2.resize(gray, (round(width / scale), round(height / scale)),
+                           interpolation=cv2.INTER_AREA)
+    level = cv2.equalizeHist(level)
+    # au premier niveau on cherche les visages de MIN_FACE à 4 * MIN_FACE
+    # pixels, aux suivants (deux fois plus petits) ceux de 2 * MIN_FACE à
+    # 4 * MIN_FACE : la cascade y balaie l'image pixel par pixel, aussi
+    # finement que `detectMultiScale` sur l'image entière
+    min_size, max_size = MIN_FACE, 4 * MIN_FACE
+    tasks = []
+    while min(level.shape) >= min_size:
+        # au dernier niveau on cherche les visages de toutes les tailles
+        if min(level.shape) < 2 * max_size:
+            tasks.append((level, (0, 0), scale, min_size, None))
+            break
+        # le recouvrement des tuiles (la taille maximale d'un visage à ce
+        # niveau) garantit que chaque visage est entier dans une tuile
+        for y in range(0, level.shape[0], TILE):
+            for x in range(0, level.shape[1], TILE):
+                tile = level[y:y + TILE + max_size, x:x + TILE + max_size]
+                tasks.append((tile, (x, y), scale, min_size, max_size - 1))
+        level = cv2.pyrDown(level)
+        scale *= 2
+        min_size = 2 * MIN_FACE
+    return tasks
+
+def merge_faces(faces):
+    """Fusionne les détections d'un même visage (tuiles qui se recouvrent,
+    niveaux voisins de la pyramide) en ne gardant que la plus grande."""
+    kept = []
+    for x, y, w, h in sorted(faces, key=lambda face: face[2] * face[3], reverse=True):
+        for kx, ky, kw, kh in kept:
+            ix = min(x + w, kx + kw) - max(x, kx)
+            iy = min(y + h, ky + kh) - max(y, ky)
+            if ix > 0 and iy > 0 and ix * iy > 0.5 * w * h:
+                break
+        else:
+            kept.append((x, y, w, h))
+    return kept
+
+def detect_faces(filepath, workers=None):
+    """Retourne les rectangles (x, y, w, h) des visages détectés dans
+    l'image `filepath`, en répartissant les tuiles de la pyramide entre
+    `workers` processus (par défaut un par cœur)."""
+    gray = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise OSError(f"lecture de l'image '{filepath}' impossible")
+    tasks = pyramid_tasks(gray)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # une même fenêtre peut être vue par deux tuiles qui se recouvrent
+        candidates = {face for tile_faces in executor.map(detect_tile, tasks)
+                      for face in tile_faces}
+    faces, _ = cv2.groupRectangles([list(face) for face in candidates],
+                                   MIN_NEIGHBORS, 0.2)
+    return merge_faces([tuple(int(v) for v in face) for face in faces])
+
+def orders_from_faces(faces, in_filename, out_filename, shape_type="ellipse"):
+    """Retourne les ordres qui floutent les visages `faces` de l'image
+    `in_filename` dans l'image `out_filename`, chaque visage étant
+    recouvert par une forme 'ellipse' ou 'circle'."""
+    shapes = []
+    for x, y, w, h in faces:
+        # on déborde du rectangle détecté pour couvrir front, menton et oreilles
+        cx, cy = round(x + w / 2, 1), round(y + h / 2, 1)
+        if shape_type == "circle":
+            shapes.append({"type": "circle", "x": cx, "y": cy,
+                           "r": round(0.65 * max(w, h), 1)})
+        else:
+            shapes.append({"type": "ellipse", "x": cx, "y": cy,
+                           "a": round(0.55 * w, 1), "b": round(0.75 * h, 1)})
+    return {"in": in_filename, "out": out_filename, "shapes": shapes}
+
+def blurred_filename(filename):
+    """Nom de l'image floutée produite à partir de l'image `filename`."""
+    return os.path.splitext(filename)[0] + "-flou.png"
+
+def main():
+    """Programme principal qui détecte les visages d'une image et écrit le
+    fichier d'ordres correspondant (par défaut à côté de l'image)."""
+    parser = argparse.ArgumentParser(
+        description="Écrit les ordres de floutage des visages détectés dans une image.")
+    parser.add_argument("image", help="image dont on détecte les visages")
+    parser.add_argument("orders", nargs="?", default=None,
+                        help="fichier d'ordres à écrire (par défaut <image>-visages.json)")
+    parser.add_argument("--force", action="store_true",
+                        help="remplace le fichier d'ordres s'il existe déjà")
+    args = parser.parse_args()
+    image_filename = args.image
+    orders_filename = args.orders
+    if orders_filename is None:
+        orders_filename = os.path.splitext(image_filename)[0] + "-visages.json"
+    if os.path.exists(orders_filename) and not args.force:
+        print(f"** Le fichier d'ordres '{orders_filename}' existe déjà (--force pour le remplacer)")
+        sys.exit(1)
+
+    faces = detect_faces(image_filename)
+    print(f"{len(faces)} visage(s) détecté(s) dans '{image_filename}'.")
+    # les chemins d'un fichier d'ordres sont relatifs à son répertoire
+    dirname = os.path.dirname(orders_filename)
+    in_filename = os.path.relpath(image_filename, dirname or ".")
+    orders = orders_from_faces(faces, in_filename, blurred_filename(in_filename))
+    with open(orders_filename, "w") as f:
+        json.dump(orders, f, indent=2)
+    print(f"Ordres enregistrés sous '{orders_filename}'.")
+
+if __name__ == "__main__":
+    main()
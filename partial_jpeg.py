@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""Réécriture partielle d'un fichier JPEG : seuls les MCU (blocs 8x8 ou
+16x16 selon le sous-échantillonnage) qui recouvrent une forme sont
+ré-encodés. Les bits compressés des autres MCU sont recopiés tels quels
+depuis le fichier source, avec ses tables de Huffman : leurs
+coefficients DCT sont donc identiques au bit près. Une fois décodés,
+leurs pixels peuvent toutefois différer juste au bord d'un MCU modifié,
+car le décodeur interpole la chrominance sous-échantillonnée entre blocs
+voisins.
+
+Pour trouver la position de chaque MCU dans le flux, le décodage
+entropique reste nécessaire du début de l'intervalle de redémarrage qui
+contient un MCU modifié jusqu'à ce MCU ; les intervalles sans MCU
+modifié sont recopiés sans être décodés. Sans marqueurs de redémarrage,
+le coût dépend donc de la position du dernier MCU modifié. L'écriture
+partielle est abandonnée (l'appelant enregistre alors toute l'image)
+au-delà de MAX_DECODED_MCUS MCU à décoder, ou si les tables de Huffman
+d'origine n'ont pas de code pour un symbole des MCU ré-encodés (tables
+optimisées).
+
+Seul le JPEG séquentiel de base (SOF0/SOF1, codage de Huffman, 8 bits,
+un seul scan, 1 ou 3 composantes) est pris en charge."""
+import struct
+from math import cos, pi, sqrt
+from simple_image import Image
+
+# ZIGZAG[k] est l'indice (ligne * 8 + colonne) du k-ième coefficient
+# dans l'ordre du flux JPEG
+ZIGZAG = [
+    0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+]
+
+# matrice de la DCT 8 points orthonormée
+DCT_MATRIX = [[(sqrt(0.125) if u == 0 else 0.5) * cos((2 * x + 1) * u * pi / 16)
+               for x in range(8)] for u in range(8)]
+
+# nombre maximal de MCU à décoder : au-delà, l'écriture partielle serait
+# plus lente qu'un enregistrement complet par PIL
+MAX_DECODED_MCUS = 4096
+
+# exceptions levées par l'analyse d'un fichier tronqué ou mal formé
+MALFORMED = (ValueError, IndexError, TypeError, struct.error)
+
+class BitReader:
+    """Lecture bit à bit d'un segment de données compressées (déjà
+    débarrassé de ses octets de bourrage 0x00)."""
+
+    def __init__(self, data):
+        self.data = data + b"\xff\xff\xff"
+        self.pos = 0
+
+    def decode(self, table):
+        """Lit un symbole avec la table de décodage `table`."""
+        p = self.pos
+        i = p >> 3
+        word = (self.data[i] << 16) | (self.data[i + 1] << 8) | self.data[i + 2]
+        length, symbol = table[(word >> (8 - (p & 7))) & 0xFFFF]
+        self.pos = p + length
+        return symbol
+
+    def receive_extend(self, size):
+        """Lit un entier signé codé sur `size` bits."""
+        if size == 0:
+            return 0
+        p = self.pos
+        i = p >> 3
+        word = (self.data[i] << 16) | (self.data[i + 1] << 8) | self.data[i + 2]
+        value = (word >> (24 - (p & 7) - size)) & ((1 << size) - 1)
+        self.pos = p + size
+        if value < (1 << (size - 1)):
+            value -= (1 << size) - 1
+        return value
+
+class BitWriter:
+    """Écriture bit à bit de données compressées (avec ajout des octets
+    de bourrage 0x00 après chaque 0xFF)."""
+
+    def __init__(self):
+        self.out = bytearray()
+        self.acc = 0
+        self.nbits = 0
+
+    def write(self, code, length):
+        self.acc = (self.acc << length) | code
+        self.nbits += length
+        while self.nbits >= 8:
+            self.nbits -= 8
+            byte = (self.acc >> self.nbits) & 0xFF
+            self.out.append(byte)
+            if byte == 0xFF:
+                self.out.append(0)
+        self.acc &= (1 << self.nbits) - 1
+
+    def copy(self, data, start, end):
+        """Recopie les bits `start` (inclus) à `end` (exclu) de `data`
+        (données sans octets de bourrage)."""
+        if end <= start:
+            return
+        first, last = start >> 3, (end + 7) >> 3
+        length = end - start
+        value = (int.from_bytes(data[first:last], "big") >> (8 * last - end)) & ((1 << length) - 1)
+        value |= self.acc << length
+        total = self.nbits + length
+        self.nbits = total % 8
+        self.out += (value >> self.nbits).to_bytes(total // 8, "big").replace(b"\xff", b"\xff\x00")
+        self.acc = value & ((1 << self.nbits) - 1)
+
+    def flush(self):
+        """Complète le dernier octet avec des bits à 1."""
+        if self.nbits:
+            self.write((1 << (8 - self.nbits)) - 1, 8 - self.nbits)
+
+def decoding_table(bits, values):
+    """Construit la table de décodage de Huffman indexée par les 16
+    prochains bits du flux, donnant (longueur du code, symbole)."""
+    table = [None] * 65536
+    code = 0
+    k = 0
+    for length in range(1, 17):
+        span = 1 << (16 - length)
+        for _ in range(bits[length - 1]):
+            table[code * span:(code + 1) * span] = [(length, values[k])] * span
+            code += 1
+            k += 1
+        code <<= 1
+    return table
+
+def encoding_table(bits, values):
+    """Associe à chaque symbole son code de Huffman (code, longueur)."""
+    codes = {}
+    code = 0
+    k = 0
+    for length in range(1, 17):
+        for _ in range(bits[length - 1]):
+            codes[values[k]] = (code, length)
+            code += 1
+            k += 1
+        code <<= 1
+    return codes
+
+def block_symbols(block, pred):
+    """Liste les symboles de Huffman d'un bloc (coefficients dans l'ordre
+    zigzag) : des tuples (table AC ?, symbole, bits additionnels,
+    nombre de bits additionnels)."""
+    diff = block[0] - pred
+    size = abs(diff).bit_length()
+    symbols = [(False, size, diff if diff >= 0 else diff + (1 << size) - 1, size)]
+    run = 0
+    for k in range(1, 64):
+        value = block[k]
+        if value == 0:
+            run += 1
+            continue
+        while run > 15:
+            symbols.append((True, 0xF0, 0, 0))
+            run -= 16
+        size = abs(value).bit_length()
+        symbols.append((True, (run << 4) | size,
+                        value if value > 0 else value + (1 << size) - 1, size))
+        run = 0
+    if run:
+        symbols.append((True, 0x00, 0, 0))
+    return symbols
+
+def read_header(data):
+    """Analyse l'en-tête JPEG jusqu'au marqueur SOS. Retourne la liste
+    des segments (marqueur, contenu), la description de l'image et la
+    position du début des données compressées."""
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("pas un fichier JPEG")
+    segments = []
+    frame = {"qtables": {}, "dc": {}, "ac": {}, "dc_codes": {}, "ac_codes": {},
+             "restart": 0}
+    pos = 2
+    while True:
+        while data[pos] == 0xFF and data[pos + 1] == 0xFF:
+            pos += 1
+        if data[pos] != 0xFF:
+            raise ValueError(f"marqueur attendu à la position {pos}")
+        marker = data[pos + 1]
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        payload = data[pos + 4:pos + 2 + length]
+        segments.append((marker, payload))
+        pos += 2 + length
+        if marker in (0xC0, 0xC1):
+            precision, height, width, count = struct.unpack(">BHHB", payload[:6])
+            if precision != 8 or count not in (1, 3):
+                raise ValueError("seules les images 8 bits à 1 ou 3 composantes sont prises en charge")
+            frame["width"], frame["height"] = width, height
+            frame["components"] = []
+            for i in range(count):
+                cid, sampling, tq = payload[6 + 3 * i:9 + 3 * i]
+                h, v = (sampling >> 4, sampling & 15) if count == 3 else (1, 1)
+                frame["components"].append({"id": cid, "h": h, "v": v, "tq": tq})
+        elif 0xC2 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            raise ValueError(f"type de JPEG 0x{marker:02X} non pris en charge (progressif, arithmétique...)")
+        elif marker == 0xDB:
+            i = 0
+            while i < len(payload):
+                pq, tq = payload[i] >> 4, payload[i] & 15
+                if pq == 0:
+                    frame["qtables"][tq] = list(payload[i + 1:i + 65])
+                    i += 65
+                else:
+                    frame["qtables"][tq] = list(struct.unpack(">64H", payload[i + 1:i + 129]))
+                    i += 129
+        elif marker == 0xC4:
+            i = 0
+            while i < len(payload):
+                tc, th = payload[i] >> 4, payload[i] & 15
+                bits = list(payload[i + 1:i + 17])
+                values = list(payload[i + 17:i + 17 + sum(bits)])
+                (frame["ac"] if tc else frame["dc"])[th] = decoding_table(bits, values)
+                codes = frame["ac_codes"] if tc else frame["dc_codes"]
+                codes[th] = encoding_table(bits, values)
+                i += 17 + sum(bits)
+        elif marker == 0xDD:
+            frame["restart"] = struct.unpack(">H", payload[:2])[0]
+        elif marker == 0xEE and payload[:5] == b"Adobe" and len(payload) >= 12:
+            if payload[11] == 0 and len(frame.get("components", [None] * 3)) == 3:
+                raise ValueError("JPEG Adobe en RGB non pris en charge")
+        elif marker == 0xDA:
+            if "components" not in frame:
+                raise ValueError("marqueur SOF absent")
+            count = payload[0]
+            if count != len(frame["components"]):
+                raise ValueError("JPEG à plusieurs scans non pris en charge")
+            by_id = {comp["id"]: comp for comp in frame["components"]}
+            frame["scan"] = []
+            for i in range(count):
+                cid, tables = payload[1 + 2 * i:3 + 2 * i]
+                comp = by_id[cid]
+                comp["td"], comp["ta"] = tables >> 4, tables & 15
+                frame["scan"].append(comp)
+            if tuple(payload[1 + 2 * count:4 + 2 * count]) != (0, 63, 0):
+                raise ValueError("paramètres de scan non séquentiels")
+            return segments, frame, pos
+
+def split_scan(data, pos):
+    """Découpe les données compressées qui commencent à `pos` en
+    intervalles séparés par les marqueurs RSTn (octets de bourrage
+    retirés). Retourne ces intervalles et la position du marqueur qui
+    termine le scan."""
+    intervals = []
+    start = pos
+    while True:
+        pos = data.index(b"\xff", pos)
+        following = data[pos + 1]
+        if following == 0x00:
+            pos += 2
+        elif following == 0xFF:
+            pos += 1
+        else:
+            intervals.append(data[start:pos].replace(b"\xff\x00", b"\xff"))
+            if 0xD0 <= following <= 0xD7:
+                pos += 2
+                start = pos
+            else:
+                return intervals, pos
+
+def mcu_geometry(frame):
+    """Retourne la taille en pixels d'un MCU et le nombre de MCU par
+    ligne et par colonne."""
+    hmax = max(comp["h"] for comp in frame["components"])
+    vmax = max(comp["v"] for comp in frame["components"])
+    mcu_width, mcu_height = 8 * hmax, 8 * vmax
+    mcus_x = -(-frame["width"] // mcu_width)
+    mcus_y = -(-frame["height"] // mcu_height)
+    return mcu_width, mcu_height, mcus_x, mcus_y
+
+def decode_coefficients(frame, intervals, keep=None, limit=None):
+    """Décode (sans transformée inverse) les coefficients quantifiés des
+    MCU de l'ensemble `keep` (par défaut tous) : pour chaque composante,
+    `comp["blocks"][by][bx]` est la liste des 64 coefficients du bloc dans
+    l'ordre zigzag. Seuls les intervalles de redémarrage qui contiennent
+    un MCU de `keep` sont décodés, depuis leur début jusqu'au MCU qui suit
+    leur dernier MCU de `keep` (pour connaître la fin de celui-ci). Retourne pour chaque MCU décodé (indexé par son
+    numéro) la position en bits de son début dans son intervalle et les
+    prédicteurs DC des composantes à ce début. Lève ValueError s'il y a
+    plus de `limit` MCU à décoder."""
+    _, _, mcus_x, mcus_y = mcu_geometry(frame)
+    total = mcus_x * mcus_y
+    if keep is None:
+        keep = range(total)
+    for comp in frame["scan"]:
+        comp["blocks"] = [[None] * (mcus_x * comp["h"]) for _ in range(mcus_y * comp["v"])]
+    per_interval = frame["restart"] or total
+    # dernier MCU à décoder dans chaque intervalle
+    lasts = {}
+    for n in keep:
+        interval = n // per_interval
+        last = min(n + 1, (interval + 1) * per_interval - 1, total - 1)
+        lasts[interval] = max(last, lasts.get(interval, last))
+    count = sum(last - interval * per_interval + 1 for interval, last in lasts.items())
+    if limit is not None and count > limit:
+        raise ValueError(f"{count} MCU à décoder (au plus {limit})")
+    starts = {}
+    for interval, last in sorted(lasts.items()):
+        reader = BitReader(intervals[interval])
+        preds = [0] * len(frame["scan"])
+        for n in range(interval * per_interval, last + 1):
+            starts[n] = (reader.pos, tuple(preds))
+            my, mx = divmod(n, mcus_x)
+            for c, comp in enumerate(frame["scan"]):
+                dc_table, ac_table = frame["dc"][comp["td"]], frame["ac"][comp["ta"]]
+                for j in range(comp["v"]):
+                    for i in range(comp["h"]):
+                        block = [0] * 64
+                        preds[c] += reader.receive_extend(reader.decode(dc_table))
+                        block[0] = preds[c]
+                        k = 1
+                        while k < 64:
+                            rs = reader.decode(ac_table)
+                            run, size = rs >> 4, rs & 15
+                            if size == 0:
+                                if run != 15:
+                                    break
+                                k += 16
+                            else:
+                                k += run
+                                block[k] = reader.receive_extend(size)
+                                k += 1
+                        comp["blocks"][my * comp["v"] + j][mx * comp["h"] + i] = block
+    return starts
+
+def forward_dct(samples):
+    """DCT 2D de 64 échantillons (ligne par ligne) centrés sur 0."""
+    rows = [sum(DCT_MATRIX[u][x] * samples[y * 8 + x] for x in range(8))
+            for y in range(8) for u in range(8)]
+    return [sum(DCT_MATRIX[v][y] * rows[y * 8 + u] for y in range(8))
+            for v in range(8) for u in range(8)]
+
+def quantize(coefs, qtable):
+    """Quantifie des coefficients DCT (ordre naturel) avec la table
+    `qtable` (ordre zigzag) et les retourne dans l'ordre zigzag."""
+    block = []
+    for k in range(64):
+        value = coefs[ZIGZAG[k]] / qtable[k]
+        value = int(value + 0.5) if value >= 0 else -int(0.5 - value)
+        # les coefficients AC d'un JPEG de base tiennent sur 10 bits
+        block.append(value if k == 0 else max(-1023, min(1023, value)))
+    return block
+
+def encode_mcu(im, frame, mx, my):
+    """Ré-encode les blocs du MCU (mx, my) à partir des pixels de `im`."""
+    mcu_width, mcu_height, _, _ = mcu_geometry(frame)
+    x0, y0 = mx * mcu_width, my * mcu_height
+    # conversion en YCbCr des pixels du MCU (hors de l'image on répète
+    # les pixels du bord)
+    planes = [[], [], []]
+    for y in range(y0, y0 + mcu_height):
+        for x in range(x0, x0 + mcu_width):
+            r, g, b = im.get_color((min(x, im.width - 1), min(y, im.height - 1)))
+            planes[0].append(0.299 * r + 0.587 * g + 0.114 * b)
+            planes[1].append(-0.168736 * r - 0.331264 * g + 0.5 * b + 128)
+            planes[2].append(0.5 * r - 0.418688 * g - 0.081312 * b + 128)
+    hmax, vmax = mcu_width // 8, mcu_height // 8
+    for c, comp in enumerate(frame["components"]):
+        fx, fy = hmax // comp["h"], vmax // comp["v"]
+        qtable = frame["qtables"][comp["tq"]]
+        for j in range(comp["v"]):
+            for i in range(comp["h"]):
+                # sous-échantillonnage par moyenne des pixels
+                samples = []
+                for sy in range(8):
+                    for sx in range(8):
+                        px, py = (i * 8 + sx) * fx, (j * 8 + sy) * fy
+                        total = sum(planes[c][(py + dy) * mcu_width + px + dx]
+                                    for dy in range(fy) for dx in range(fx))
+                        samples.append(total / (fx * fy) - 128)
+                block = quantize(forward_dct(samples), qtable)
+                comp["blocks"][my * comp["v"] + j][mx * comp["h"] + i] = block
+
+def copy_scan(frame, intervals, starts, recoded):
+    """Écrit le scan en recopiant les bits compressés des MCU d'origine et
+    en recodant, avec les tables de Huffman d'origine, les MCU de
+    l'ensemble `recoded`. Lève KeyError si un symbole n'a pas de code
+    dans ces tables."""
+    _, _, mcus_x, mcus_y = mcu_geometry(frame)
+    total = mcus_x * mcus_y
+    per_interval = frame["restart"] or total
+    writer = BitWriter()
+    for k, data in enumerate(intervals):
+        if k:
+            writer.flush()
+            writer.out += bytes([0xFF, 0xD0 + (k - 1) % 8])
+        first, end = k * per_interval, min((k + 1) * per_interval, total)
+        pos = 0
+        preds = None
+        for n in sorted(n for n in recoded if first <= n < end):
+            start, original_preds = starts[n]
+            writer.copy(data, pos, start)
+            # le MCU précédent n'a pas été recodé : ses DC sont ceux d'origine
+            if n == first or n - 1 not in recoded:
+                preds = list(original_preds)
+            my, mx = divmod(n, mcus_x)
+            for c, comp in enumerate(frame["scan"]):
+                dc_codes = frame["dc_codes"][comp["td"]]
+                ac_codes = frame["ac_codes"][comp["ta"]]
+                for j in range(comp["v"]):
+                    for i in range(comp["h"]):
+                        block = comp["blocks"][my * comp["v"] + j][mx * comp["h"] + i]
+                        for is_ac, symbol, extra, size in block_symbols(block, preds[c]):
+                            writer.write(*(ac_codes if is_ac else dc_codes)[symbol])
+                            if size:
+                                writer.write(extra, size)
+                        preds[c] = block[0]
+            pos = starts[n + 1][0] if n + 1 < end else None
+        # fin de l'intervalle (bits de remplissage compris)
+        if pos is not None:
+            writer.copy(data, pos, 8 * len(data))
+    writer.flush()
+    return bytes(writer.out)
+
+def save_partial_jpeg(im, src_filepath, boxes, filepath):
+    """Écrit dans `filepath` le fichier JPEG `src_filepath` dont seuls les
+    MCU qui recouvrent une des boîtes `boxes` ((x0, y0, x1, y1), bornes x1
+    et y1 exclues) sont ré-encodés à partir des pixels de `im`. Retourne
+    False, sans rien écrire, si `src_filepath` utilise une variante de
+    JPEG non prise en charge."""
+    with open(src_filepath, "rb") as f:
+        data = f.read()
+    try:
+        segments, frame, pos = read_header(data)
+        if (frame["width"], frame["height"]) != im.definition:
+            raise ValueError("dimensions différentes de celles de l'image")
+        intervals, pos = split_scan(data, pos)
+        if data[pos:pos + 2] != b"\xff\xd9":
+            raise ValueError("JPEG à plusieurs scans non pris en charge")
+        mcu_width, mcu_height, mcus_x, mcus_y = mcu_geometry(frame)
+        total = mcus_x * mcus_y
+        touched = set()
+        for x0, y0, x1, y1 in boxes:
+            for my in range(y0 // mcu_height, (y1 - 1) // mcu_height + 1):
+                for mx in range(x0 // mcu_width, (x1 - 1) // mcu_width + 1):
+                    touched.add(my * mcus_x + mx)
+        # le MCU qui suit un MCU modifié dans le même intervalle doit être
+        # recodé : la différence de son DC avec le précédent a changé
+        recoded = set(touched)
+        for n in touched:
+            if n + 1 < total and not (frame["restart"] and (n + 1) % frame["restart"] == 0):
+                recoded.add(n + 1)
+        starts = decode_coefficients(frame, intervals, recoded, MAX_DECODED_MCUS)
+    except MALFORMED as e:
+        Image.errtrace(f"ré-encodage partiel impossible pour '{src_filepath}' : {e}")
+        return False
+
+    for n in sorted(touched):
+        encode_mcu(im, frame, n % mcus_x, n // mcus_x)
+    try:
+        scan = copy_scan(frame, intervals, starts, recoded)
+    except KeyError:
+        # recoder tout le scan avec de nouvelles tables serait bien plus
+        # lent qu'un enregistrement complet par PIL
+        Image.errtrace(f"ré-encodage partiel impossible pour '{src_filepath}' :"
+                       " tables de Huffman incomplètes")
+        return False
+
+    out = bytearray(b"\xff\xd8")
+    for marker, payload in segments:
+        out += bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+    out += scan + b"\xff\xd9"
+    with open(filepath, "wb") as f:
+        f.write(out)
+    Image.errtrace(f"écriture partielle d'une image JPEG"
+                   f" ({im.width}x{im.height}, {len(touched)} MCU ré-encodés)"
+                   f" dans le fichier '{filepath}'.")
+    return True
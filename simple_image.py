@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
+import os
 import sys
+import zlib
 import PIL.Image
 import PIL.features
 import PIL.ImageShow
@@ -9,6 +11,29 @@ from packaging import version
 assert version.parse(PIL.features.version('pil')) >= version.parse("8.3.2"), \
        "PIL version should be >= 8.3.2"
 
+# réglages des encodeurs PIL pour chaque profil d'écriture et chaque
+# format (les formats absents gardent les réglages par défaut de PIL)
+ENCODER_PROFILES = {
+    "fastest": {
+        # pas d'entrée JPEG : les réglages par défaut de PIL (sans
+        # optimisation des tables de Huffman) sont déjà les plus rapides
+        "PNG": {"compress_level": 1, "compress_type": zlib.Z_RLE},
+        "WEBP": {"quality": 75, "method": 0},
+    },
+    # même qualité que les autres profils, compression intermédiaire : plus
+    # rapide que 'smallest' et plus compact que 'fastest'
+    "balanced": {
+        "PNG": {"compress_level": 5},
+        "JPEG": {"quality": 75, "optimize": True},
+        "WEBP": {"quality": 75, "method": 4},
+    },
+    "smallest": {
+        "PNG": {"compress_level": 9, "optimize": True},
+        "JPEG": {"quality": 75, "optimize": True, "progressive": True},
+        "WEBP": {"quality": 75, "method": 6},
+    },
+}
+
 class Image:
     trace = True
 
@@ -63,8 +88,31 @@ class Image:
         self._check_color(color)
         self._pil_image.putpixel(xy, color)
 
-    def save(self, filepath):
-        self._pil_image.save(filepath)
+    def fill_box(self, box, color):
+        """remplit la boîte `box` (x0, y0, x1, y1), bornes x1 et y1 exclues,
+        avec la couleur `color`"""
+        self._check_color(color)
+        self._pil_image.paste(tuple(color), box)
+
+    def copy(self):
+        """copie de l'image"""
+        return Image(self._pil_image.copy())
+
+    def same_region(self, other, box):
+        """les images `self` et `other` ont-elles les mêmes pixels dans la
+        boîte `box` (x0, y0, x1, y1), bornes x1 et y1 exclues ?"""
+        return (self._pil_image.crop(box).tobytes()
+                == other._pil_image.crop(box).tobytes())
+
+    def save(self, filepath, profile=None):
+        """écrit l'image avec les réglages d'encodeur du profil `profile`
+        (une clé de ENCODER_PROFILES, None : réglages par défaut de PIL)"""
+        options = {}
+        if profile is not None:
+            extension = os.path.splitext(filepath)[1].lower()
+            image_format = PIL.Image.registered_extensions().get(extension)
+            options = ENCODER_PROFILES[profile].get(image_format, {})
+        self._pil_image.save(filepath, **options)
         self.errtrace(f"écriture d'une image"
                       f" ({self._pil_image.width}x{self._pil_image.height})"
                       f" dans le fichier '{filepath}'.")
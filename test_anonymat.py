@@ -0,0 +1,81 @@
+"""Vérifications du floutage de `anonymat-p3.py` (à lancer avec pytest
+depuis le répertoire du projet)."""
+import os
+import importlib.util
+import pytest
+from simple_image import Image
+
+HERE = os.path.dirname(__file__)
+IMAGES = os.path.join(HERE, "images")
+
+# le nom du script contient un tiret : on le charge comme un module
+spec = importlib.util.spec_from_file_location("anonymat", os.path.join(HERE, "anonymat-p3.py"))
+anonymat = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(anonymat)
+
+SHAPES = [
+    {"type": "circle", "x": 300, "y": 200, "r": 40},
+    {"type": "rectangle", "c1x": 10.5, "c1y": 20.5, "c2x": 130.5, "c2y": 90.5},
+    {"type": "ellipse", "x": 600, "y": 400, "a": 70, "b": 35},
+]
+
+@pytest.fixture(scope="module")
+def chats():
+    Image.trace = False
+    return Image.read(os.path.join(IMAGES, "chats.jpg"))
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_sampled_exact_at_step_1(chats, shape):
+    # aucune estimation n'atteint une erreur nulle : on va jusqu'au pas 1
+    color, error, n = anonymat.average_color_sampled(chats, shape, 1e-9)
+    assert color == anonymat.average_color_shape(chats, shape)
+    assert error == (0.0, 0.0, 0.0)
+    assert n == len(anonymat.shape_mask(chats, shape))
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_sampled_error_bound(chats, shape):
+    max_error = 5
+    color, error, n = anonymat.average_color_sampled(chats, shape, max_error)
+    assert max(error) <= max_error
+    if n < len(anonymat.shape_mask(chats, shape)):
+        exact = anonymat.average_color_shape(chats, shape)
+        # l'intervalle de confiance à 95 % contient presque toujours la
+        # vraie moyenne ; la graine fixe rend le test déterministe
+        assert all(abs(color[c] - exact[c]) <= max_error + 1 for c in range(3))
+
+def test_deadline_fallback_covers_shapes(chats):
+    orders = {"in": "chats.png", "out": "chats-flou.png", "shapes": SHAPES}
+    # délai déjà dépassé : toutes les formes sont approchées
+    im_out, boxes, degraded = anonymat.process_orders(orders, chats, deadline=0)
+    assert degraded == list(range(len(SHAPES)))
+    for shape, box in zip(SHAPES, boxes):
+        color = anonymat.average_color_lattice(chats, shape)
+        x0, y0, x1, y1 = box
+        for x, y in anonymat.shape_mask(chats, shape):
+            assert x0 <= x < x1 and y0 <= y < y1
+            assert im_out.get_color((x, y)) == color
+
+def test_shape_at_frame():
+    shape = {"type": "circle", "keyframes": [
+        {"frame": 10, "x": 0, "y": 100, "r": 10},
+        {"frame": 20, "x": 100, "y": 100, "r": 30},
+    ]}
+    assert anonymat.shape_at_frame(shape, 15) == {"type": "circle", "x": 50, "y": 100, "r": 20}
+    # avant la première et après la dernière image clé, la forme est figée
+    assert anonymat.shape_at_frame(shape, 2) == {"type": "circle", "x": 0, "y": 100, "r": 10}
+    assert anonymat.shape_at_frame(shape, 25) == {"type": "circle", "x": 100, "y": 100, "r": 30}
+    assert anonymat.shape_at_frame(shape, 20) == {"type": "circle", "x": 100, "y": 100, "r": 30}
+    # une forme sans images clés ne change pas
+    assert anonymat.shape_at_frame(SHAPES[0], 15) is SHAPES[0]
+
+def test_frame_number():
+    assert anonymat.frame_number("frame0012.png") == 12
+    assert anonymat.frame_number("take2-007.jpg") == 7
+    assert anonymat.frame_number("v2.png") == 2
+    assert anonymat.frame_number("frame.png") is None
+
+def test_list_frames(tmp_path):
+    for name in ["f10.png", "f2.png", "f1.png", "notes.txt", "f5.jpg"]:
+        (tmp_path / name).touch()
+    assert anonymat.list_frames(str(tmp_path)) == [
+        (1, "f1.png"), (2, "f2.png"), (5, "f5.jpg"), (10, "f10.png")]
@@ -0,0 +1,83 @@
+"""Vérifications aller-retour de `partial_jpeg.save_partial_jpeg`
+(à lancer avec pytest depuis le répertoire du projet)."""
+import os
+import pytest
+from PIL import Image as PILImage
+from simple_image import Image
+from partial_jpeg import read_header, split_scan, decode_coefficients, mcu_geometry, save_partial_jpeg
+
+IMAGES = os.path.join(os.path.dirname(__file__), "images")
+
+def coefficients(filepath):
+    """Décode les coefficients de tous les blocs du fichier `filepath`."""
+    with open(filepath, "rb") as f:
+        data = f.read()
+    _, frame, pos = read_header(data)
+    intervals, _ = split_scan(data, pos)
+    decode_coefficients(frame, intervals)
+    return frame
+
+@pytest.mark.parametrize("name", ["chats.jpg", "une-personne.jpg"])
+def test_no_box_keeps_file(tmp_path, name):
+    src = os.path.join(IMAGES, name)
+    out = str(tmp_path / name)
+    assert save_partial_jpeg(Image.read(src), src, [], out)
+    with open(src, "rb") as f_src, open(out, "rb") as f_out:
+        assert f_src.read() == f_out.read()
+
+def check_untouched_blocks(src, out, box):
+    """Vérifie que seuls les blocs des MCU qui recouvrent `box` ont changé
+    entre les fichiers `src` et `out`, et que `out` se décode."""
+    PILImage.open(out).load()
+    before, after = coefficients(src), coefficients(out)
+    mcu_width, mcu_height, _, _ = mcu_geometry(before)
+    changed = False
+    for comp_before, comp_after in zip(before["scan"], after["scan"]):
+        for by, (row_before, row_after) in enumerate(zip(comp_before["blocks"], comp_after["blocks"])):
+            for bx, (block_before, block_after) in enumerate(zip(row_before, row_after)):
+                mx, my = bx // comp_before["h"], by // comp_before["v"]
+                touched = (box[0] // mcu_width <= mx <= (box[2] - 1) // mcu_width
+                           and box[1] // mcu_height <= my <= (box[3] - 1) // mcu_height)
+                if touched:
+                    changed = changed or block_before != block_after
+                else:
+                    assert block_before == block_after, (bx, by)
+    assert changed
+
+def test_untouched_blocks_unchanged(tmp_path):
+    src = os.path.join(IMAGES, "une-personne.jpg")
+    out = str(tmp_path / "une-personne.jpg")
+    box = (170, 40, 260, 120)
+    im = Image.read(src)
+    im.fill_box(box, (255, 0, 0))
+    assert save_partial_jpeg(im, src, [box], out)
+    check_untouched_blocks(src, out, box)
+
+def test_restart_intervals(tmp_path):
+    # une forme en bas de l'image : seul le dernier intervalle est décodé
+    src = str(tmp_path / "source.jpg")
+    out = str(tmp_path / "out.jpg")
+    PILImage.open(os.path.join(IMAGES, "une-personne.jpg")).save(src, restart_marker_rows=1)
+    with open(src, "rb") as f:
+        assert read_header(f.read())[1]["restart"] > 0
+    im = Image.read(src)
+    box = (im.width - 60, im.height - 40, im.width - 10, im.height)
+    im.fill_box(box, (255, 0, 0))
+    assert save_partial_jpeg(im, src, [box], out)
+    check_untouched_blocks(src, out, box)
+
+def test_optimized_tables_unsupported(tmp_path):
+    # les tables optimisées de chats.jpg n'ont pas de code pour ce bloc
+    src = os.path.join(IMAGES, "chats.jpg")
+    out = tmp_path / "chats.jpg"
+    box = (170, 40, 260, 120)
+    im = Image.read(src)
+    im.fill_box(box, (255, 0, 0))
+    assert not save_partial_jpeg(im, src, [box], str(out))
+    assert not out.exists()
+
+def test_progressive_unsupported(tmp_path):
+    src = os.path.join(IMAGES, "enfants.jpg")
+    out = tmp_path / "enfants.jpg"
+    assert not save_partial_jpeg(Image.read(src), src, [], str(out))
+    assert not out.exists()